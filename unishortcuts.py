@@ -26,7 +26,7 @@ passing metadata to build_shortcuts for shortcuts creation.
 """
 import os
 import sys
-import re
+import functools
 from pathlib import Path
 from distutils.core import Command
 from distutils.command.build import build
@@ -35,7 +35,7 @@ from distutils.command.build import build
 __ALL__ = ['build', 'build_shortcuts', 'Shortcut']
 
 
-def _get_platform():
+def _detect_platform():
     if sys.platform == 'darwin':
         return 'darwin'
     if os.name == 'nt' or sys.platform.startswith('win'):
@@ -44,26 +44,39 @@ def _get_platform():
         return 'linux'
 
 
-_here = Path(__file__).parent.resolve()
+def _get_platform():
+    return _PLATFORM
+
+
+_HERE = None
+_HERE_STR = None
+
+
+def _get_here():
+    global _HERE, _HERE_STR
+    if _HERE is None:
+        here = os.path.dirname(os.path.abspath(__file__))
+        _HERE = Path(here)
+        _HERE_STR = os.path.join(here, '')
+    return _HERE
 
-_LINUX_DESKTOP_FORM = """[Desktop Entry]
-Version=1.1
-Encoding=UTF-8
-Name={name:s}
-GenericName={gname:s}
-Type=Application
-Comment={desc:s}
-Categories={cat:s}
-Keywords={keys:s}
-Icon={icon:s}
-Exec={script:s} {args:s}
-TryExec={script:s}
-Terminal={term:s}
-"""
 
-_FREE_DESKTOP_CATEGORIES = ['AudioVideo', 'Audio', 'Video', 'Development',
-                            'Education', 'Game', 'Graphics', 'Network',
-                            'Office', 'Settings', 'System', 'Utility']
+def _get_here_str():
+    # source directory as a string ending with a path separator
+    _get_here()
+    return _HERE_STR
+
+
+def _is_inside_here(path):
+    here = _get_here_str()
+    path = os.path.abspath(os.path.join(here, os.fspath(path)))
+    return path.startswith(here)
+
+
+_FREE_DESKTOP_CATEGORIES_TUPLE = ('AudioVideo', 'Audio', 'Video', 'Development',
+                                  'Education', 'Game', 'Graphics', 'Network',
+                                  'Office', 'Settings', 'System', 'Utility')
+_FREE_DESKTOP_CATEGORIES = frozenset(_FREE_DESKTOP_CATEGORIES_TUPLE)
 
 # A command line may contain at most one %f, %u, %F or %U field code.
 # If the application should not open any file the %f, %u, %F and %U
@@ -73,6 +86,97 @@ _LINUX_SPECIAL_ARGS = {'SINGLE_FILE': '%f', 'FILES_LIST': '%F',
 
 _ICON_EXT = {'linux': ('ico', 'svg', 'png'), 'win': ('ico',), 'darwin': ('icns',)}
 
+# The running platform can't change during the process lifetime.
+_PLATFORM = _detect_platform()
+_PLATFORM_ICON_EXT = _ICON_EXT.get(_PLATFORM, ())
+
+
+@functools.lru_cache(maxsize=256)
+def _find_icons(name):
+    data = _get_here() / 'data'
+    return tuple(p for p in data.glob('%s.*' % name)
+                 if p.suffix[1:] in _PLATFORM_ICON_EXT)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_data_files():
+    try:
+        with os.scandir(_get_here() / 'data') as entries:
+            return frozenset(e.name for e in entries)
+    except OSError:
+        return frozenset()
+
+
+def _icon_exists(icon):
+    # relative icons are resolved like in _is_inside_here, and the data
+    # directory is checked with one listing instead of a stat per icon;
+    # a miss still asks the filesystem, which may be case-insensitive
+    here = _get_here_str()
+    path = os.path.abspath(os.path.join(here, os.fspath(icon)))
+    data = os.path.join(here, 'data')
+    if (os.path.normcase(os.path.dirname(path)) == os.path.normcase(data)
+            and os.path.basename(path) in _get_data_files()):
+        return True
+    return os.path.exists(path)
+
+
+def _guess_category(classifiers):
+    for cf in classifiers:
+        cf = [c.strip() for c in cf.split('::')]
+        if cf[0] == 'Topic':
+            for c in cf:
+                if c in _FREE_DESKTOP_CATEGORIES:
+                    return c
+    return ''
+
+
+def _to_str(s):
+    if not s:
+        return ''
+    if type(s) is str:
+        return s
+    return str(s)
+
+
+def _coerce_strlist(s):
+    if isinstance(s, list):
+        if all(type(i) is str for i in s):
+            return list(s)
+        return [str(i) for i in s]
+    if isinstance(s, str):
+        return s.replace(',', ' ').split()
+    if s is None:
+        return []
+    raise(TypeError())
+
+
+def _render_linux_desktop(scut, terminal):
+    args = scut.arguments
+    if scut.special_arg:
+        args = args + [_LINUX_SPECIAL_ARGS[scut.special_arg]]
+    exe = ' '.join([scut.script] + args)
+    cat = scut.category + ';' if scut.category else ''
+    keys = ''.join(k + ';' for k in scut.keywords)
+    icon = ''
+    if scut.icon:
+        # desktop environments can't resolve a relative Icon= value
+        icon = os.path.abspath(os.path.join(_get_here_str(), os.fspath(scut.icon[0])))
+    term = 'true' if terminal else 'false'
+    return f"""[Desktop Entry]
+Version=1.1
+Encoding=UTF-8
+Name={scut.name}
+GenericName={scut.generic_name}
+Type=Application
+Comment={scut.description}
+Categories={cat}
+Keywords={keys}
+Icon={icon}
+Exec={exe}
+TryExec={scut.script}
+Terminal={term}
+"""
+
 
 class Shortcut():
     """A representation of a Shortcut parameters and metadata.
@@ -108,63 +212,32 @@ class Shortcut():
     mime_type:    The MIME type(s) supported by this application. Defaults to None.
     """
 
-    _instances = set()
+    __slots__ = ('_script', 'name', 'generic_name', 'description', '_icon',
+                 '_arguments', '_special_arg', '_category', '_keywords',
+                 '_mime_type', '_hash')
 
-    def __new__(cls, script, name=None, generic_name=None, description=None,
-                icon=None, arguments=None, special_arg=None, category=None,
-                keywords=None, mime_type=None):
-        instance = super(Shortcut, cls).__new__(cls)
-        cls.__init__(instance, script, name, generic_name, description, icon,
-                     arguments, special_arg, category, keywords, mime_type)
-        cls._instances.add(instance)
-        return instance
+    _instances = {}
 
     def __init__(self, script, name=None, generic_name=None, description=None,
                  icon=None, arguments=None, special_arg=None, category=None,
                  keywords=None, mime_type=None):
-        self.script = script
-        self.name = name
-        self.generic_name = generic_name
-        self.description = description
+        self._script = _to_str(script)
+        self._hash = hash(self._script)
+        self.name = _to_str(name)
+        self.generic_name = _to_str(generic_name)
+        self.description = _to_str(description)
         self.icon = icon
         self.arguments = arguments
         self.special_arg = special_arg
         self.category = category
         self.keywords = keywords
         self.mime_type = mime_type
+        self._instances[self._script] = self
 
     @property
     def script(self):
         return self._script
 
-    @script.setter
-    def script(self, s):
-        self._script = str(s) if s else ''
-
-    @property
-    def name(self):
-        return self._name
-
-    @name.setter
-    def name(self, s):
-        self._name = str(s) if s else ''
-
-    @property
-    def generic_name(self):
-        return self._generic_name
-
-    @generic_name.setter
-    def generic_name(self, s):
-        self._generic_name = str(s) if s else ''
-
-    @property
-    def description(self):
-        return self._description
-
-    @description.setter
-    def description(self, s):
-        self._description = str(s) if s else ''
-
     @property
     def icon(self):
         return self._icon
@@ -172,11 +245,13 @@ class Shortcut():
     @icon.setter
     def icon(self, s):
         if isinstance(s, list):
-            self._icon = [Path(i) for i in s]
+            self._icon = [i if isinstance(i, Path) else Path(i) for i in s]
+        elif isinstance(s, Path):
+            self._icon = [s]
         else:
             self._icon = [Path(s)] if s else []
         for i in self._icon:
-            if i.root != _here:
+            if not _is_inside_here(i):
                 raise(AttributeError('icon %s path not inside source directory' % i))
 
     @property
@@ -185,14 +260,7 @@ class Shortcut():
 
     @arguments.setter
     def arguments(self, s):
-        if isinstance(s, list):
-            self._arguments = [str(i) for i in s]
-        elif isinstance(s, str):
-            self._arguments = re.split(r',\s*|\s+', s)
-        elif s is None:
-            self._arguments = []
-        else:
-            raise(TypeError())
+        self._arguments = _coerce_strlist(s)
 
     @property
     def special_arg(self):
@@ -213,12 +281,12 @@ class Shortcut():
 
     @category.setter
     def category(self, s):
-        if s in _FREE_DESKTOP_CATEGORIES:
+        if isinstance(s, str) and s in _FREE_DESKTOP_CATEGORIES:
             self._category = s
         elif s is None:
             self._category = ''
         else:
-            raise(TypeError('Arguments should be one of %s' % _FREE_DESKTOP_CATEGORIES))
+            raise(TypeError('Arguments should be one of %s' % (_FREE_DESKTOP_CATEGORIES_TUPLE,)))
 
     @property
     def keywords(self):
@@ -226,14 +294,7 @@ class Shortcut():
 
     @keywords.setter
     def keywords(self, s):
-        if isinstance(s, list):
-            self._keywords = [str(i) for i in s]
-        elif isinstance(s, str):
-            self._keywords = re.split(r',\s*|\s+', s)
-        elif s is None:
-            self._keywords = []
-        else:
-            raise(TypeError())
+        self._keywords = _coerce_strlist(s)
 
     @property
     def mime_type(self):
@@ -241,22 +302,15 @@ class Shortcut():
 
     @mime_type.setter
     def mime_type(self, s):
-        if isinstance(s, list):
-            self._mime_type = [str(i) for i in s]
-        elif isinstance(s, str):
-            self._mime_type = re.split(r',\s*|\s+', s)
-        elif s is None:
-            self._mime_type = []
-        else:
-            raise(TypeError())
+        self._mime_type = _coerce_strlist(s)
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return other.name == self.name
+            return other._script == self._script
         return False
 
     def __hash__(self):
-        return hash(self.name)
+        return self._hash
 
     def __repr__(self):
         return 'Shortcut %s for script %s' % (self.name, self.script)
@@ -274,6 +328,10 @@ class build_shortcuts(Command):
         """Set default values for options."""
         self.build_base = None
         self.desktop = None
+        # distribution metadata, read once by run()
+        self._cached_description = ''
+        self._cached_category = ''
+        self._cached_keywords = []
 
     def finalize_options(self):
         """Post-process options."""
@@ -283,28 +341,56 @@ class build_shortcuts(Command):
 
     def run(self):
         """Run command."""
-        # look for enrty_points
-        group = 'console_scripts'
-        if hasattr(self.distribution, 'entry_points') and group in self.distribution.entry_points:
-            for ep in self.distribution.entry_points[group]:
-                shortcut = self._get_metadatas(ep.split('=')[0].strip())
-
-                # _LINUX_DESKTOP_FORM.format(name=name, desc=desc,
-        #                            exe=executable, icon=scut.icon,
-        #                            script=scut.full_script, args=scut.arguments,
-        #                            term='true' if terminal else 'false')
+        # distribution metadata are the same for every shortcut
+        metadata = self.distribution.metadata
+        classifiers = metadata.get_classifiers()
+        self._cached_description = _to_str(metadata.get_description())
+        self._cached_category = _guess_category(classifiers)
+        self._cached_keywords = metadata.get_keywords()
+
+        # data directory content may have changed since a previous run
+        _get_data_files.cache_clear()
+        _find_icons.cache_clear()
+
+        # a script declared several times is only looked up once per run
+        get_metadatas = functools.lru_cache(maxsize=128)(self._get_metadatas)
+
+        # look for enrty_points, console scripts need a terminal
+        entry_points = getattr(self.distribution, 'entry_points', None) or {}
+        groups = (('gui_scripts', False), ('console_scripts', True))
+        if any(group in entry_points for group, _ in groups):
+            # gui_scripts come first, so their entry wins over a console one
+            built = set()
+            for group, terminal in groups:
+                for ep in entry_points.get(group, ()):
+                    script = ep.split('=')[0].strip()
+                    if script in built:
+                        self.warn('%s already has a shortcut, skipping its %s entry'
+                                  % (script, group))
+                        continue
+                    built.add(script)
+                    shortcut = get_metadatas(script)
+                    if _PLATFORM == 'linux':
+                        self._write_desktop_file(shortcut, terminal)
         else:
             self.warn('no entry_points found')
-        self.warn(self.distribution.metadata.get_classifiers())
+        self.warn(classifiers)
+
+    def _write_desktop_file(self, scut, terminal=False):
+        build_dir = os.path.join(self.build_base, 'shortcuts')
+        # mkpath() remembers the directory as created even in dry-run mode
+        if not self.dry_run:
+            self.mkpath(build_dir)
+        dest = Path(build_dir) / ('%s.desktop' % scut.script)
+        # the whole entry is rendered first then written in one go
+        self.execute(dest.write_text,
+                     (_render_linux_desktop(scut, terminal), 'utf-8'),
+                     'writing %s' % dest)
 
     def _get_metadatas(self, script):
         # If user didn't created a Shortcut object,
         # try to guess obvious metadata from the distribution.
-        shortcut = Shortcut(script)
-        for s in Shortcut._instances:
-            if s.script == script:
-                shortcut = s
-                break
+        shortcut = Shortcut._instances.get(script) or Shortcut(script)
         # name
         if not shortcut.name:
             shortcut.name = shortcut.script
@@ -313,34 +399,21 @@ class build_shortcuts(Command):
             shortcut.generic_name = shortcut.name
         # icon
         if not shortcut.icon:
-            data = _here / 'data'
-            if data.is_dir():
-                icons = data.glob('%s.*' % shortcut.name)
-                icons = [icon for icon in icons if icon.suffix in _ICON_EXT[_get_platform()]]
-                shortcut.icon = icons
-            else:
-                shortcut.icon = None
+            shortcut.icon = list(_find_icons(shortcut.name))
         else:
-            for ic in shortcut.icon:
-                if not ic.exists():
-                    shortcut.icon.remove(ic)
+            # paths were already checked by the icon setter
+            shortcut._icon = [ic for ic in shortcut.icon if _icon_exists(ic)]
         # description
         if not shortcut.description:
-            shortcut.description = self.distribution.metadata.get_description()
+            shortcut.description = self._cached_description
 
         # category
         if not shortcut.category:
-            for cf in self.distribution.metadata.get_classifiers():
-                cf = [c.strip() for c in cf.split('::')]
-                if cf[0] == 'Topic':
-                    for c in cf:
-                        if c in _FREE_DESKTOP_CATEGORIES:
-                            shortcut.category = c
-                            break
+            shortcut.category = self._cached_category or None
 
         # keywords
         if not shortcut.keywords:
-            shortcut.keywords = self.distribution.metadata.get_keywords()
+            shortcut.keywords = self._cached_keywords
 
         return shortcut
 
@@ -349,7 +422,7 @@ class build_shortcuts(Command):
 build.sub_commands.append(('build_shortcuts', None))
 
 
-# if _get_platform() == 'linux':
+# if _PLATFORM == 'linux':
 #     home = Path.home()
 #     ud = home / '.config' / 'user-dirs.dirs'
 #     if ud.exists():